@@ -1,9 +1,12 @@
 from setuptools import setup, find_packages
+import re
 
 
 def parse_requirements():
+    # strip comments ('#' at the start of a line or after whitespace, as pip does) and skip blank lines
     with open("requirements.txt", "r") as requirements:
-        return requirements.read().splitlines()
+        lines = (re.sub(r"(^|\s)#.*$", "", line).strip() for line in requirements)
+        return [line for line in lines if line]
 
 
 setup(
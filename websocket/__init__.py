@@ -1,2 +1,4 @@
 from websocket.socket_wrapper import SocketWrapper
 from websocket.exchange_strategy_interface import ExchangeStrategyInterface
+from websocket.event_loop import install_uvloop
+from websocket.socket_interface import VerboseCallback
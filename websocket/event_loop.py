@@ -0,0 +1,20 @@
+import asyncio
+
+
+def install_uvloop() -> bool:
+    """
+    Sets uvloop as the asyncio event loop policy, if it is installed.
+    Must be called before the event loop is created, e.g. before `asyncio.run(main())`.
+
+    Note: uvloop transports are implemented in C, so techniques that monkey-patch `transport.write`
+    (e.g. to coalesce writes) have no effect under uvloop and should not be used.
+
+    :return: True if uvloop was installed, False if the default event loop is used.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return False
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
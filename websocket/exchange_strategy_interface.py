@@ -14,6 +14,8 @@ class ExchangeStrategyInterface(ABC):
     async def start(self, manager) -> None:
         """
         Add any exchange specific tasks to the start method in `SocketWrapper`.
+        This runs again on every reconnect, so create background tasks with `manager.create_connection_task`,
+        which cancels them on reconnect and disconnect.
 
         :param manager: (Exchange)SocketManager class. e.g. `DeribitSocketManager`
         :return: None.
@@ -1,17 +1,27 @@
 # 'logs' module is provided by the 'logging_notifications' package
 from logs.logger_helper import LoggerHelper
 import asyncio
+import inspect
 import websockets
 from abc import ABC, abstractmethod
-from typing import Optional, Callable
+from typing import Optional, Callable, AsyncContextManager, Coroutine, Union
 
 
 def default_callback(obj):
-    print(obj)
+    pass  # no-op, printing every message would serialize the event loop on the stdout lock
 
 
 def default_reconnect_callback():
-    print("Reconnected!")
+    pass
+
+
+class VerboseCallback:
+    """
+    Opt-in callback that prints every message received, e.g. `SocketWrapper(url, callback=VerboseCallback())`.
+    Meant for debugging, printing at exchange message rates will slow the event loop down.
+    """
+    def __call__(self, obj) -> None:
+        print(obj)
 
 
 class SocketInterface(ABC):
@@ -36,24 +46,57 @@ class SocketInterface(ABC):
         """
         Initializes the Websocket with the URL, and call back methods for receiving messages, and reconnections.
 
-        Sets up instance variables for the websocket, a task to listen for messages, and an asynchronous lock for safe reconnections.
+        Sets up instance variables for the websocket, tasks to listen for and dispatch messages, and an asynchronous lock for safe reconnections.
         """
         self.logger = LoggerHelper(__file__)
         self.ws_url = ws_url
         self.run_time = run_time
         self.callback = callback if callback else default_callback
         self.reconnect_callback = reconnect_callback if reconnect_callback else default_reconnect_callback
+        self.callback_is_coroutine = inspect.iscoroutinefunction(self.callback)
+        self.reconnect_callback_is_coroutine = inspect.iscoroutinefunction(self.reconnect_callback)
         self.websocket = None
+        self.tasks = set()
+        self.connection_tasks = set()
         self.listener_task = None
-        self.reconnect_lock = asyncio.Lock()
-        self.timer = 0
+        self.dispatcher_task = None
+        self._reconnect_lock = None  # created on first reconnect, see reconnect_lock
+        self.reconnect_generation = 0
+        self.retry_sleep = 1.0  # current connection retry sleep in seconds, doubled per failure and reset on success
+        self.max_retry_sleep = 30.0
+        self._stop_event = None  # created on first use, see stop_event
+        self.deadline_handle = None
+        self.deadline_task = None
         self.run_flag = False
 
+    @property
+    def reconnect_lock(self) -> asyncio.Lock:
+        """
+        Asynchronous lock for safe reconnections, created lazily so instances that never reconnect don't allocate one,
+        and so the lock is bound to the loop that actually runs the socket rather than the one it was constructed on.
+
+        :return: asyncio.Lock.
+        """
+        if self._reconnect_lock is None:
+            self._reconnect_lock = asyncio.Lock()
+        return self._reconnect_lock
+
+    @property
+    def stop_event(self) -> asyncio.Event:
+        """
+        Event set by stop_stream to end run, created lazily for the same loop-binding reason as reconnect_lock.
+
+        :return: asyncio.Event.
+        """
+        if self._stop_event is None:
+            self._stop_event = asyncio.Event()
+        return self._stop_event
+
     @abstractmethod
     async def run(self) -> None:
         """
-        Creates an event loop to maintain a persistent connection with while automating the process
-        of disconnecting and reconnecting based on a given run_time.
+        Maintains a persistent connection until the stream is stopped, then disconnects.
+        Reconnecting based on a given run_time is driven by a single deadline timer scheduled in start.
 
         :return: None.
         """
@@ -72,20 +115,52 @@ class SocketInterface(ABC):
     def start(self) -> None:
         """
         Starts the Websocket connection.
-        This is where you call the connect method, set the listener task, and any other necessary tasks such as a heart beat task.
+        This is where you call the connect method, set the listener task, any other necessary tasks such as a heart beat task,
+        and schedule the run_time deadline.
+
+        :return: None.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_task(self, coro: Coroutine) -> asyncio.Task:
+        """
+        Create a task that is tracked by the socket, and cancelled and awaited on disconnect.
+        Use this for background tasks that outlive a single connection.
+
+        :param coro: Coroutine to run.
+        :return: asyncio.Task.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_connection_task(self, coro: Coroutine) -> asyncio.Task:
+        """
+        Create a tracked task that belongs to the current connection, and is also cancelled on reconnect.
+        Use this for tasks started by an ExchangeStrategy, e.g. heart beat tasks, since strategy.start runs again on every reconnect.
+        A connection task may call reconnect itself (e.g. a heart beat watchdog): the reconnect then runs in its own task,
+        and the calling task is cancelled along with the other connection tasks.
+
+        :param coro: Coroutine to run.
+        :return: asyncio.Task.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def cancel_connection_tasks(self) -> None:
+        """
+        Cancel and await every task created with create_connection_task.
 
         :return: None.
         """
         raise NotImplementedError
 
     @abstractmethod
-    async def connect(self, retry_sleep: int, backoff: int) -> websockets.WebSocketClientProtocol:
+    async def connect(self) -> websockets.WebSocketClientProtocol:
         """
         Connect to the websocket and return the WebSocketClientProtocol.
-        Implement a simple backoff mechanism using the retry_sleep and backoff parameters for any failed connections.
+        Implement a jittered exponential backoff for any failed connections, using the retry_sleep and max_retry_sleep attributes.
 
-        :param retry_sleep: Retry sleep time in seconds.
-        :param backoff: Exponential backoff factor.
         :return: WebSocketClientProtocol.
         """
         raise NotImplementedError
@@ -93,7 +168,18 @@ class SocketInterface(ABC):
     @abstractmethod
     async def listen(self) -> None:
         """
-        Listen on the websocket for incoming messages.
+        Listen on the websocket for incoming messages. Messages are parsed with orjson, falling back to json for NaN/Infinity.
+        Note orjson parses integers wider than 64 bits as floats, losing precision. The listener task persists across reconnects,
+        and triggers the reconnect itself when the connection drops. Parse each message and put it on a bounded queue, so a slow callback applies backpressure to the websocket.
+
+        :return: None.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def dispatch_messages(self) -> None:
+        """
+        Drain the queue filled by the listen method.
         Implement the handle_message method here for calling the callback method.
 
         :return: None.
@@ -114,6 +200,9 @@ class SocketInterface(ABC):
     async def send_message(self, message) -> None:
         """
         Send a message to the websocket.
+        Messages are serialized with orjson, falling back to json for values orjson rejects, such as integers wider than 64 bits.
+        Messages sent within the same event loop iteration are buffered and written together by a single flush task.
+        The message is written after this returns, so send failures are logged by the flush task rather than raised here.
 
         :param message: The message to send.
         :return: None.
@@ -121,10 +210,69 @@ class SocketInterface(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    async def reconnect(self) -> None:
+    async def send_raw(self, payload: Union[str, bytes]) -> None:
+        """
+        Send an already serialized payload to the websocket, skipping JSON encoding.
+        Useful for messages that never change, such as heartbeats, which can be serialized once up front.
+        A str payload is sent as a text frame, bytes as a binary frame.
+
+        :param payload: The serialized message to send.
+        :return: None.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def send_many(self, messages: list) -> None:
+        """
+        Send a batch of messages to the websocket with a single flush.
+
+        :param messages: The messages to send, in order.
+        :return: None.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def buffered_send(self, max_batch: int) -> AsyncContextManager:
+        """
+        Async context manager that yields a `send(message)` coroutine function. Messages passed to it are collected
+        and sent with send_many on exit, or whenever max_batch messages are collected.
+        Only messages passed to the yielded function are held, send_message calls are unaffected.
+        If the block raises, messages still held are discarded rather than sent.
+
+        :param max_batch: Maximum number of buffered messages before an early flush.
+        :return: AsyncContextManager.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def flush_now(self) -> None:
+        """
+        Write any buffered messages immediately and wait until they are sent.
+        Use after send_message for latency-sensitive requests. Send failures are logged, not raised.
+
+        :return: None.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def reconnect(self, generation: Optional[int]) -> None:
+        """
+        Manually close, and reconnect to the websocket. Use the close_websocket method to close the websocket,
+        so the listener and dispatcher tasks keep running on the new connection.
+
+        :param generation: reconnect_generation of the connection the caller saw fail. If it has changed since,
+            another caller already reconnected and this is a no-op. Defaults to the current generation.
+        :return: None.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def close_websocket(self, timeout: float) -> None:
         """
-        Manually disconnect, and reconnect to the websocket. Use the disconnect method to disconnect the websocket.
+        Close the current websocket connection without stopping the listener and dispatcher tasks.
+        If the closing handshake doesn't finish within the timeout, abort the connection instead.
 
+        :param timeout: Close timeout in seconds.
         :return: None.
         """
         raise NotImplementedError
@@ -132,7 +280,7 @@ class SocketInterface(ABC):
     @abstractmethod
     async def disconnect(self) -> None:
         """
-        Disconnect from the websocket.
+        Disconnect from the websocket, cancelling every task created with create_task.
 
         :return: None.
         """
@@ -159,7 +307,7 @@ class SocketInterface(ABC):
     @abstractmethod
     async def stop_stream(self, task: asyncio.Task) -> None:
         """
-        Flags the run_flag to trigger a disconnection and awaits the websocket connection task.
+        Flags the run_flag and sets the stop_event to trigger a disconnection, then awaits the websocket connection task.
 
         :param task: Websocket connection task.
         :return: None.
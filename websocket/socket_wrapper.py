@@ -1,10 +1,35 @@
 from .socket_interface import SocketInterface
 from .exchange_strategy_interface import ExchangeStrategyInterface
 import asyncio
+import contextlib
+import random
 import websockets
+import orjson
 import json
 import inspect
-from typing import Optional, Callable
+import logging
+from typing import Optional, Callable, Coroutine, Union
+
+try:  # C extension shipped in the websockets binary wheels, missing on pure Python installs
+    from websockets.speedups import apply_mask  # noqa: F401
+    WEBSOCKETS_SPEEDUPS = True
+except ImportError:
+    WEBSOCKETS_SPEEDUPS = False
+    logging.getLogger(__name__).warning("websockets C speedups unavailable, frame masking will run in pure Python.")
+
+
+def encode_message(message) -> str:
+    try:  # decode to keep sending text frames, allow non-str dict keys as json.dumps did
+        return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode()
+    except TypeError:  # e.g. integers wider than 64 bits, which json.dumps supports
+        return json.dumps(message)
+
+
+def decode_message(message):
+    try:
+        return orjson.loads(message)
+    except orjson.JSONDecodeError:  # e.g. NaN/Infinity, which json.loads accepts
+        return json.loads(message)
 
 
 class SocketWrapper(SocketInterface):
@@ -15,96 +40,290 @@ class SocketWrapper(SocketInterface):
             callback: Optional[Callable] = None,
             reconnect_callback: Optional[Callable] = None,
             strategy: Optional[ExchangeStrategyInterface] = None,
+            inbox_size: int = 1024,
     ):
         super().__init__(ws_url, run_time, callback, reconnect_callback)
         self.wrapper_logger = self.logger.get_logger(__name__)
         self.strategy = strategy
+        self.inbox_size = inbox_size
+        self._inbox = None  # created on first use, see inbox
+        self._connected_event = None  # created on first use, see connected_event
+        self.send_buffer = []
+        self.send_flush_task = None
+        self.message_pipeline = self.build_message_pipeline()
 
-    async def run(self) -> None:
-        while self.run_flag:
-            await asyncio.sleep(1)
-            self.timer += 1
+    @property
+    def inbox(self) -> asyncio.Queue:
+        # bounded, so a slow callback pauses reading instead of growing memory. Created lazily so it binds
+        # to the running loop on Python 3.8/3.9, like reconnect_lock
+        if self._inbox is None:
+            self._inbox = asyncio.Queue(maxsize=self.inbox_size)
+        return self._inbox
 
-            if self.timer > self.run_time:  # sleep for n(time) before manually disconnecting and reconnecting
-                await self.handle_expired_run_time()
+    @property
+    def connected_event(self) -> asyncio.Event:
+        # set whenever start assigns a new websocket, so the listener can resume reading it. Created lazily like inbox
+        if self._connected_event is None:
+            self._connected_event = asyncio.Event()
+        return self._connected_event
 
-        await self.disconnect()  # disconnect once we exit the loop
+    async def run(self) -> None:
+        try:
+            await self.stop_event.wait()  # run_time reconnects are handled by the deadline timer set in start
+        finally:
+            await self.disconnect()  # disconnect once the stream is stopped, or run fails or is cancelled
 
     async def handle_expired_run_time(self) -> None:
-        await self.reconnect()
-        self.wrapper_logger.info(f"Manual reconnect called after {self.run_time}s. Actual timer: {self.timer}")
-        self.timer = 0
-        self.wrapper_logger.info(f"Timer reset: {self.timer}")
+        self.wrapper_logger.info(f"Manual reconnect called after {self.run_time}s.")
+        await self.reconnect()  # start reschedules the deadline once reconnected
+
+    def schedule_run_time_deadline(self) -> None:
+        if self.deadline_handle:
+            self.deadline_handle.cancel()
+        self.deadline_handle = asyncio.get_running_loop().call_later(self.run_time, self.on_run_time_expired)
+
+    def on_run_time_expired(self) -> None:
+        self.deadline_handle = None
+        self.deadline_task = self.create_task(self.handle_expired_run_time())
 
     async def start(self) -> None:
         self.run_flag = True
+        self.stop_event.clear()  # allow restarting after stop_stream
         self.websocket = await self.connect()
-        self.listener_task = asyncio.create_task(self.listen())
+        self.connected_event.set()
+        # pick up strategy or callback attributes assigned directly since the pipeline was last built
+        self.callback_is_coroutine = inspect.iscoroutinefunction(self.callback)
+        self.message_pipeline = self.build_message_pipeline()
+        # the listener and dispatcher persist across reconnects, only (re)create them when not running
+        if self.listener_task is None or self.listener_task.done():
+            self.listener_task = self.create_task(self.listen())
+        if self.dispatcher_task is None or self.dispatcher_task.done():
+            self.dispatcher_task = self.create_task(self.dispatch_messages())
         if self.strategy:
             await self.strategy.start(self)
+        self.schedule_run_time_deadline()
+
+    def create_task(self, coro: Coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)  # keeps a strong reference, and lets disconnect cancel everything in one place
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def create_connection_task(self, coro: Coroutine) -> asyncio.Task:
+        task = self.create_task(coro)
+        self.connection_tasks.add(task)  # cancelled on reconnect, since strategy.start runs again for the new connection
+        task.add_done_callback(self.connection_tasks.discard)
+        return task
+
+    async def cancel_connection_tasks(self) -> None:
+        tasks = [task for task in self.connection_tasks if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-    async def connect(self, retry_sleep: int = 1, backoff: int = 1) -> websockets.WebSocketClientProtocol:
+    async def connect(self) -> websockets.WebSocketClientProtocol:
         while True:
             try:
-                return await websockets.connect(str(self.ws_url))
+                websocket = await websockets.connect(
+                    str(self.ws_url),
+                    compression=None,  # skip permessage-deflate inflation on every frame
+                    ping_interval=None if self.strategy else 20,  # strategies own the exchange heartbeat
+                    ping_timeout=None if self.strategy else 20,
+                    max_size=2 ** 20,
+                    max_queue=32,  # keep small, the bounded inbox does the buffering
+                    read_limit=2 ** 20,
+                    write_limit=2 ** 20,
+                )
+                self.retry_sleep = 1.0  # reset the backoff after a successful handshake
+                return websocket
             except Exception as Error:
-                self.wrapper_logger.error(f"Connection failed: {Error}, retrying in {backoff} seconds...")
-                await asyncio.sleep(retry_sleep * backoff)
-                backoff *= 2  # simple exponential backoff
+                sleep = self.retry_sleep * (0.5 + random.random() * 0.5)  # jitter so clients sharing a URL don't retry in lockstep
+                self.wrapper_logger.error(f"Connection failed: {Error}, retrying in {sleep:.2f} seconds...")
+                await asyncio.sleep(sleep)
+                self.retry_sleep = min(self.retry_sleep * 2, self.max_retry_sleep)  # capped exponential backoff
 
     async def listen(self) -> None:
-        if self.websocket and self.websocket.open:
+        put, loads = self.inbox.put, decode_message  # bind once rather than looking up per message
+        while self.run_flag:
+            websocket, generation = self.websocket, self.reconnect_generation
             try:
-                async for message in self.websocket:
-                    await self.handle_message(json.loads(message))
+                async for message in websocket:
+                    await put(loads(message))  # blocks while the inbox is full
             except Exception as Error:
                 self.wrapper_logger.error(f"Error in listen: {Error}")
-                await self.reconnect()
+            if self.run_flag and self.websocket is websocket:  # skip if another caller already replaced the socket
+                # reconnect in its own task, so strategy.start and the reconnect callback can wait on replies
+                # that this listener reads from the new socket
+                self.connected_event.clear()
+                self.create_task(self.reconnect_in_background(generation))
+                await self.connected_event.wait()
+
+    async def reconnect_in_background(self, generation: int) -> None:
+        try:
+            await self.reconnect(generation)
+        except Exception as Error:
+            self.wrapper_logger.error(f"Error in reconnect: {Error}")
+        finally:
+            self.connected_event.set()  # wake the listener even if the reconnect failed, so it can retry
+
+    async def dispatch_messages(self) -> None:
+        get, handle = self.inbox.get, self.handle_message  # bind once rather than looking up per message
+        while True:
+            message = await get()
+            try:
+                await handle(message)
+            except Exception as Error:
+                self.wrapper_logger.error(f"Error in handle_message: {Error}")
 
     async def handle_message(self, message) -> None:
+        await self.message_pipeline(message)  # looked up per message so add_callback_method applies immediately
+
+    def build_message_pipeline(self) -> Callable:
+        # the strategy and callback are fixed between calls to start and add_callback_method, so pick the
+        # matching pipeline once instead of branching on every message
+        manager, callback = self, self.callback
         if self.strategy:
-            await self.strategy.handle_message(self, message)
-        await self.callback(message) if inspect.iscoroutinefunction(self.callback) else self.callback(message)
+            strategy_handle_message = self.strategy.handle_message
+            if self.callback_is_coroutine:
+                async def pipeline(message):
+                    await strategy_handle_message(manager, message)
+                    await callback(message)
+            else:
+                async def pipeline(message):
+                    await strategy_handle_message(manager, message)
+                    callback(message)
+        elif self.callback_is_coroutine:
+            pipeline = callback
+        else:
+            async def pipeline(message):
+                callback(message)
+        return pipeline
 
     async def send_message(self, message) -> None:
-        if self.websocket and self.websocket.open:
-            await self.websocket.send(json.dumps(message))
+        self.send_buffer.append(encode_message(message))
+        self.schedule_flush()
+
+    async def send_raw(self, payload: Union[str, bytes]) -> None:
+        self.send_buffer.append(payload)
+        self.schedule_flush()
+
+    async def send_many(self, messages: list) -> None:
+        self.send_buffer.extend(encode_message(message) for message in messages)
+        await self.flush_now()
+
+    @contextlib.asynccontextmanager
+    async def buffered_send(self, max_batch: int = 128):
+        batch = []  # local to the block, so sends from other tasks (e.g. heartbeat replies) are never held back
+
+        async def send(message) -> None:
+            batch.append(message)
+            if len(batch) >= max_batch:
+                await self.send_many(batch)
+                batch.clear()
+
+        yield send
+        if batch:  # only reached on normal exit, a batch half-built when the block raised is discarded
+            await self.send_many(batch)
+
+    def schedule_flush(self) -> None:
+        # the flush task runs on the next loop iteration, so every send issued before then shares it
+        if self.send_flush_task is None:
+            self.send_flush_task = self.create_task(self.flush_send())
+
+    async def flush_send(self) -> None:
+        try:
+            if self.websocket is None:  # disconnected, drop the messages as sending to a stopped stream is a no-op
+                self.send_buffer = []
+            while self.send_buffer:  # pick up messages buffered while we were writing
+                buffer, self.send_buffer = self.send_buffer, []
+                for payload in buffer:
+                    try:
+                        await self.websocket.send(payload)
+                    except websockets.ConnectionClosed:
+                        raise
+                    except Exception as Error:  # e.g. a bad payload type, drop just this message and keep going
+                        self.wrapper_logger.error(f"Error in flush_send, dropping 1 message: {Error}")
+        except websockets.ConnectionClosed as Error:
+            # the listener sees the same close and reconnects, so just drop what couldn't be sent
+            self.wrapper_logger.error(f"Connection closed while sending, dropping unsent messages: {Error}")
+            self.send_buffer = []
+        except Exception as Error:
+            self.wrapper_logger.error(f"Error in flush_send: {Error}")
+        finally:
+            self.send_flush_task = None
+
+    async def flush_now(self) -> None:
+        if self.send_flush_task is None:
+            self.send_flush_task = self.create_task(self.flush_send())
+        await asyncio.shield(self.send_flush_task)
 
-    async def reconnect(self) -> None:
+    async def reconnect(self, generation: Optional[int] = None) -> None:
+        if asyncio.current_task() in self.connection_tasks:
+            # run outside the calling connection task, so cancel_connection_tasks cancels the caller too instead of
+            # leaving it running next to the copy strategy.start creates. shield keeps the reconnect going when it does
+            await asyncio.shield(self.create_task(self.reconnect(generation)))
+            return
         self.wrapper_logger.info("Reconnect Called.")
+        if generation is None:
+            generation = self.reconnect_generation
+        elif generation != self.reconnect_generation:
+            return  # the connection the caller saw fail has already been replaced
+        await asyncio.sleep(1)  # rest for a moment before reconnecting, outside the lock so waiters aren't serialized
+        if generation != self.reconnect_generation:
+            return  # fast path, another caller reconnected during the rest, skip the lock entirely
+        # asyncio.Lock.acquire already returns without creating a waiter Future when uncontended
         async with self.reconnect_lock:  # prevent concurrent reconnections
-            await self.disconnect()
-            await asyncio.sleep(1)  # rest for a moment before reconnecting
+            if generation != self.reconnect_generation:
+                return  # another caller already reconnected while we were waiting
+            await self.close_websocket()  # the listener task may be the caller, so leave the tasks running
+            await self.cancel_connection_tasks()  # strategy.start spawns them again in start
             await self.start()
+            self.reconnect_generation += 1
             self.wrapper_logger.info("Reconnected to WebSocket.")
             if self.reconnect_callback:
-                await self.reconnect_callback() if inspect.iscoroutinefunction(self.reconnect_callback) else self.reconnect_callback()
+                await self.reconnect_callback() if self.reconnect_callback_is_coroutine else self.reconnect_callback()
 
     async def disconnect(self) -> None:
-        if self.listener_task:
-            self.listener_task.cancel()
-        if self.websocket:
-            await self.websocket.close()
-            self.websocket = None
+        if self.deadline_handle:
+            self.deadline_handle.cancel()
+            self.deadline_handle = None
+        tasks = [task for task in self.tasks if task is not asyncio.current_task()]
+        for task in tasks:  # cancel first, so nothing reacts to the socket closing
+            task.cancel()
+        await self.close_websocket()
+        self.websocket = None
 
-        try:
-            await self.listener_task
-        except asyncio.CancelledError:
-            self.wrapper_logger.info("Tasks cancelled.")
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.listener_task = None
+        self.dispatcher_task = None
+        self.deadline_task = None
+        self._inbox = None  # kept across reconnects, but a restart after stopping shouldn't deliver stale messages
+        self.wrapper_logger.info("Tasks cancelled.")
         self.wrapper_logger.info("Disconnected from Websocket.")
 
+    async def close_websocket(self, timeout: float = 2.0) -> None:
+        if self.websocket:
+            try:
+                await asyncio.wait_for(self.websocket.close(), timeout=timeout)
+            except asyncio.TimeoutError:  # the peer is gone, don't wait on the closing handshake
+                self.wrapper_logger.warning(f"Websocket close timed out after {timeout}s, aborting connection.")
+                self.websocket.transport.abort()
+
     def add_callback_method(self, callback: Callable) -> None:
         self.callback = callback
+        self.callback_is_coroutine = inspect.iscoroutinefunction(callback)
+        self.message_pipeline = self.build_message_pipeline()
 
     def add_reconnect_callback_method(self, reconnect_callback: Callable) -> None:
         self.reconnect_callback = reconnect_callback
+        self.reconnect_callback_is_coroutine = inspect.iscoroutinefunction(reconnect_callback)
 
     async def stop_stream(self, task: asyncio.Task) -> None:
         self.run_flag = False
-        if task:
-            task.cancel()
+        self.stop_event.set()  # lets run disconnect gracefully
         try:
-            await task
+            if task:
+                await task
         except asyncio.CancelledError:
             self.wrapper_logger.info(f"Websocket stream task cancelled.")
         self.wrapper_logger.info(f"Successfully stopped stream. Run Flag: {self.run_flag}")